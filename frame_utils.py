@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+"""
+相机图像帧处理工具函数。
+"""
+
+import numpy as np
+
+
+def frame_to_gray_array(frame_out) -> np.ndarray:
+    """
+    将SDK输出的单通道图像帧（MV_FRAME_OUT）复制为二维灰度图。
+    直接按 pBufAddr 指针映射SDK缓冲区，不经过中间bytes拷贝；
+    返回独立副本，释放SDK缓冲区后仍可使用。
+    """
+    frame_info = frame_out.stFrameInfo
+    height, width = frame_info.nHeight, frame_info.nWidth
+    if frame_info.nFrameLen < height * width:
+        raise ValueError(
+            f"图像数据长度不足（{frame_info.nFrameLen} < {height}x{width}）"
+        )
+    return np.ctypeslib.as_array(frame_out.pBufAddr, shape=(height, width)).copy()
@@ -1,10 +1,12 @@
 import paho.mqtt.client as mqtt
+import socket
 import time
 
 # ------------------- 配置参数 -------------------
 MQTT_BROKER = "xs.jldg.com"  # 公共 MQTT 服务器（无需注册，可直接使用）
 MQTT_PORT = 1883  # MQTT 基础端口（无加密）
-MQTT_CLIENT_ID = "ocr_client_" + str(time.time())  # 客户端 ID（需唯一，避免冲突）
+# 识别服务客户端 ID：按主机名固定，重启后可恢复服务器端会话（同一主机只运行一个识别服务）
+MQTT_CLIENT_ID = f"ocr_client_{socket.gethostname()}"
 MQTT_TOPIC = "mqtt_plc"  # 要发布/订阅的主题
 SCAN_TOPIC = f"{MQTT_TOPIC}/scan"
 CODE_TOPIC = f"{MQTT_TOPIC}/code"
@@ -14,8 +16,8 @@ CODE_TOPIC = f"{MQTT_TOPIC}/code"
 # 1. 连接成功回调
 def on_connect(client, userdata, flags, rc, properties=None):
     print("连接 MQTT 服务器成功")
-    # 连接成功后订阅主题
-    client.subscribe(SCAN_TOPIC, qos=0)
+    # 连接成功后订阅主题；QoS 1 使服务器在持久会话中为断线期间的触发消息排队
+    client.subscribe(SCAN_TOPIC, qos=1)
     print(f"已订阅订阅主题：{SCAN_TOPIC}")
 
 
@@ -32,11 +34,13 @@ def on_publish(client, userdata, mid, properties=None):
     print("发布消息成功，消息 ID：", mid)
 
 
-def new_client():
+def new_client(client_id=MQTT_CLIENT_ID, clean_session=False):
     # ------------------- 创建客户端并配置 -------------------
     # 创建 MQTT 客户端，指定使用 MQTT v5 协议
+    # clean_session=False（默认）：断线重连或重启后保留服务器端会话和订阅
     client = mqtt.Client(
-        client_id=MQTT_CLIENT_ID,
+        client_id=client_id,
+        clean_session=clean_session,
     )
 
     # 绑定回调函数
@@ -44,13 +48,19 @@ def new_client():
     client.on_message = on_message
     client.on_publish = on_publish
 
-    # 连接 MQTT 服务器（无认证）
-    client.connect(MQTT_BROKER, port=MQTT_PORT, keepalive=60)
+    # 断线后自动重连的等待时间（秒）
+    client.reconnect_delay_set(min_delay=1, max_delay=8)
+
+    # 异步连接 MQTT 服务器（无认证），由调用方 loop_start() 后在后台完成连接
+    client.connect_async(MQTT_BROKER, port=MQTT_PORT, keepalive=60)
     return client
 
 
 def main():
-    client = new_client()
+    # 测试发布端使用独立的临时会话，避免与同一主机上的识别服务互相踢下线
+    client = new_client(
+        client_id="ocr_test_client_" + str(time.time()), clean_session=True
+    )
 
     # ------------------- 循环处理消息 -------------------
     try:
@@ -13,15 +13,20 @@
 # ==============================================================================
 # 1. 导入库
 # ==============================================================================
-import re
+import os
+
+# 限制CPU推理线程数（按物理核数调整），避免超线程下线程过多造成抖动；
+# 必须在导入numpy/cv2/paddle前设置，可通过环境变量覆盖
+os.environ.setdefault("OMP_NUM_THREADS", "4")
+os.environ.setdefault("MKL_NUM_THREADS", "4")
+
 import traceback
 import time
-import os
-from collections import Counter
+import threading
 from datetime import datetime
-from queue import Queue, Empty
-from ctypes import cast, POINTER
-from typing import Optional  # Python 3.8 兼容性：导入 Optional
+from queue import Queue, Empty, Full
+from ctypes import cast, POINTER, memset, addressof, sizeof
+from typing import List, Optional  # Python 3.8 兼容性：导入 List, Optional
 
 # 第三方库
 import cv2
@@ -34,6 +39,9 @@ from MvImport import MvCameraControl_class as mvs
 # 本地MQTT客户端
 from mqtt_client import new_client
 
+# 本地图像帧工具
+from frame_utils import frame_to_gray_array
+
 # ==============================================================================
 # 2. 全局配置
 # ==============================================================================
@@ -47,14 +55,43 @@ MQTT_TOPIC_TEST_PUB = "mqtt_plc/test"  # 测试发布的主题
 TTL_SECONDS = 5  # 收到的MQTT消息超过此秒数将被视为过期
 
 # OCR配置
-OCR_USE_GPU = False
+# 推理后端："cpu" CPU推理；"paddle_gpu" Paddle GPU推理；
+# "trt" Paddle-TensorRT推理（仅在有NVIDIA显卡且安装TensorRT时使用）
+OCR_BACKEND = "cpu"
+OCR_BACKENDS = ("cpu", "paddle_gpu", "trt")
+OCR_ENABLE_MKLDNN = True  # CPU推理启用MKL-DNN(oneDNN)加速
+OCR_CPU_THREADS = int(os.environ["OMP_NUM_THREADS"])  # CPU推理线程数
+# 进程绑定的CPU核心编号，如 {0, 1, 2, 3}；None表示不绑定（仅Linux有效）
+OCR_CPU_AFFINITY = None
+# 推理精度："fp32" / "fp16" / "int8"，None表示trt后端用fp16、其他后端用fp32
+# CPU+MKL-DNN下"fp16"对应bfloat16，需CPU支持AVX512-BF16/AMX
+# "int8"需使用量化模型
+OCR_PRECISION = None
+# 相机固定安装、文字方向固定时关闭方向分类，省去每个文本框一次分类推理
+OCR_USE_ANGLE_CLS = False
+OCR_RETRY_ROTATED = True  # 未识别到结果时旋转180度重试一次
 OCR_LANG = "ch"
 OCR_CONFIDENCE_THRESHOLD = 0.8
+OCR_WARMUP_ROUNDS = 3  # 启动时预热推理次数
+OCR_REC_BATCH_NUM = 32  # 识别模型单次推理的文本框数量，覆盖单帧最大检测框数
+# 识别区域 (y0, y1, x0, x1)，None表示使用整幅图像
+OCR_ROI = None
+# 识别区域长边超过此像素数时等比缩小，None表示不缩小
+# 检测模型内部已将输入缩放到960以内，缩小整幅图像只会降低识别模型裁剪的文字分辨率，
+# 仅在文字明显大于识别所需(约32像素高)时设置
+OCR_MAX_SIDE = None
+# 画面与上次识别成功的画面几乎相同时直接复用上次结果（按感知哈希比较）
+# 不同工件标签外观相近时可能误判为相同画面，默认关闭
+OCR_SKIP_SAME_FRAME = False
+FRAME_HASH_MAX_DISTANCE = 3  # 感知哈希汉明距离不超过此值视为相同画面
 
 # 相机配置
 CAMERA_TRIGGER_TIMEOUT_MS = 3000  # 相机取图超时时间
 CAMERA_MAX_FAILURES = 3  # 连续失败多少次后尝试重连
 
+# 识别失败图片保存配置
+SAVE_JPEG_QUALITY = 85  # 保存图片的JPEG质量
+
 # 识别码业务规则
 # True: 只返回以"LKTT"开头且长度为10的码
 # False: 返回所有清理后的字母数字组合
@@ -65,34 +102,76 @@ MV_ACCESS_MODE = mvs.MV_ACCESS_Exclusive
 # ==============================================================================
 # 3. 全局变量
 # ==============================================================================
+# 绑定CPU核心，之后创建的线程继承此设置
+if OCR_CPU_AFFINITY and hasattr(os, "sched_setaffinity"):
+    os.sched_setaffinity(0, OCR_CPU_AFFINITY)
+
 # 初始化OCR引擎
-ocr = PaddleOCR(use_angle_cls=True, lang=OCR_LANG, use_gpu=OCR_USE_GPU, show_log=False)
+if OCR_BACKEND not in OCR_BACKENDS:
+    raise ValueError(f"不支持的OCR推理后端: {OCR_BACKEND}，可选: {OCR_BACKENDS}")
+ocr = PaddleOCR(
+    use_angle_cls=OCR_USE_ANGLE_CLS,
+    lang=OCR_LANG,
+    use_gpu=OCR_BACKEND != "cpu",
+    # TensorRT动态shape信息缓存在模型目录中，首次运行后复用
+    use_tensorrt=OCR_BACKEND == "trt",
+    enable_mkldnn=OCR_ENABLE_MKLDNN and OCR_BACKEND == "cpu",
+    cpu_threads=OCR_CPU_THREADS,
+    rec_batch_num=OCR_REC_BATCH_NUM,
+    precision=OCR_PRECISION or ("fp16" if OCR_BACKEND == "trt" else "fp32"),
+    show_log=False,
+)
 
 # 相机相关
 cam = mvs.MvCamera()
+frame_out = mvs.MV_FRAME_OUT()  # 取图输出结构体，仅在拍照线程中复用
 camera_initialized = False
 consecutive_failures = 0
 
 # MQTT和队列
 mqtt_client = None
 message_queue = Queue()
+frame_queue = Queue(maxsize=1)  # 待识别图像队列，OCR线程繁忙时丢弃新图像
+save_queue = Queue(maxsize=8)  # 待保存图片队列，满时丢弃新图片
+
+# 上次识别成功的画面哈希和结果，仅在OCR线程中读写
+last_frame_hash = 0
+last_ocr_result = None
+
+# 识别码清理用的删除表：ASCII中除换行符（批量清理时的分隔符）外所有非字母数字字符
+_NON_ALNUM_BYTES = bytes(
+    b for b in range(128) if not chr(b).isalnum() and chr(b) != "\n"
+)
 
 # ==============================================================================
 # 4. 核心功能函数
 # ==============================================================================
 
 
-def fix_code(code: str) -> str:
+def fix_codes(codes: List[str]) -> List[str]:
     """
-    清理和验证识别到的字符串。
+    批量清理和验证识别到的字符串，返回有效结果。
     1. 移除非字母数字字符。
     2. 转换为大写。
     3. （可选）根据业务规则进行过滤。
+    所有字符串以换行符拼接后只做一次编码和过滤，再拆分回单个结果。
+    """
+    # 单个文本框的识别结果一般不含换行符，保险起见先移除以保证拆分正确
+    joined = "\n".join(code.replace("\n", "") for code in codes)
+    cleaned_codes = (
+        joined.encode("ascii", "ignore")
+        .translate(None, _NON_ALNUM_BYTES)
+        .upper()
+        .decode("ascii")
+        .split("\n")
+    )
+    return [code for code in map(filter_code, cleaned_codes) if code]
+
+
+def filter_code(cleaned_code: str) -> str:
+    """
+    （可选）根据业务规则过滤已清理的字符串，不符合时返回空字符串。
     """
-    if not isinstance(code, str):
-        return ""
-    cleaned_code = re.sub(r"[^a-zA-Z0-9]", "", code).upper()
-
     if ENABLE_CODE_FILTER:
         if cleaned_code.startswith(CODE_PREFIX) and len(cleaned_code) == CODE_LENGTH:
             return cleaned_code
@@ -101,6 +180,26 @@ def fix_code(code: str) -> str:
     return cleaned_code
 
 
+def warmup_ocr():
+    """
+    使用绘有文字的图像预热OCR引擎（检测+识别，启用时含方向分类），
+    避免首次触发时承担模型初始化开销。
+    检测不到文本框时PaddleOCR不会调用识别模型，因此再单独预热一次识别模型。
+    """
+    print("--- 开始预热OCR引擎 ---")
+    start = time.time()
+    # 尺寸与检测模型的默认输入边长(960)相当
+    dummy_image = np.full((960, 960), 255, dtype=np.uint8)
+    cv2.putText(
+        dummy_image, "LKTT000000", (40, 500), cv2.FONT_HERSHEY_SIMPLEX, 3, 0, 8
+    )
+    dummy_line = np.full((48, 320), 255, dtype=np.uint8)
+    for _ in range(OCR_WARMUP_ROUNDS):
+        ocr.ocr(dummy_image, cls=OCR_USE_ANGLE_CLS)
+        ocr.ocr(dummy_line, det=False, cls=OCR_USE_ANGLE_CLS)
+    print(f"--- OCR引擎预热完成，耗时 {time.time() - start:.2f} 秒 ---")
+
+
 def initialize_camera() -> bool:
     """
     初始化相机：枚举、创建句柄、打开设备、配置触发模式、开始采集。
@@ -183,23 +282,28 @@ def reconnect_camera() -> bool:
         return False
 
 
-def capture_and_ocr() -> Optional[str]:
+def capture_image() -> Optional[np.ndarray]:
     """
-    执行拍照、图像处理和OCR识别。
-    返回: 识别出的最终字符串，失败则返回None。
+    执行软件触发拍照并取图。
+    返回: 灰度图像，失败则返回None。
     """
     global consecutive_failures
-    print("\n=== 开始拍照识别 ===")
-    frame_out = None
+    print("\n=== 开始拍照 ===")
+    # 热路径上用局部名称引用SDK常量和方法，减少全局/属性查找
+    mv_ok = mvs.MV_OK
+    trigger = cam.MV_CC_SetCommandValue
+    get_buffer = cam.MV_CC_GetImageBuffer
+    free_buffer = cam.MV_CC_FreeImageBuffer
+    ret = None
     try:
         # 软件触发
-        cam.MV_CC_SetCommandValue("TriggerSoftware")
+        trigger("TriggerSoftware")
 
-        # 获取图像缓冲区
-        frame_out = mvs.MV_FRAME_OUT()
-        ret = cam.MV_CC_GetImageBuffer(frame_out, CAMERA_TRIGGER_TIMEOUT_MS)
+        # 获取图像缓冲区（复用结构体，取图前清零）
+        memset(addressof(frame_out), 0, sizeof(frame_out))
+        ret = get_buffer(frame_out, CAMERA_TRIGGER_TIMEOUT_MS)
 
-        if ret != mvs.MV_OK:
+        if ret != mv_ok:
             consecutive_failures += 1
             print(f"取图失败（错误码：{ret}），连续失败次数: {consecutive_failures}")
             if consecutive_failures >= CAMERA_MAX_FAILURES:
@@ -213,73 +317,251 @@ def capture_and_ocr() -> Optional[str]:
         consecutive_failures = 0
 
         # --- 图像处理 ---
-        frame_info = frame_out.stFrameInfo
-        image_data = np.frombuffer(
-            mvs.string_at(frame_out.pBufAddr, frame_info.nFrameLen), dtype=np.uint8
-        ).reshape(frame_info.nHeight, frame_info.nWidth)
-
-        # 转为灰度图
-        gray_image = (
-            cv2.cvtColor(image_data, cv2.COLOR_BGR2GRAY)
-            if len(image_data.shape) == 3
-            else image_data
+        # 直接映射SDK缓冲区，在释放缓冲区前复制一份灰度图
+        return frame_to_gray_array(frame_out)
+
+    except Exception as e:
+        print(f"拍照过程异常：{str(e)}")
+        traceback.print_exc()
+        return None
+    finally:
+        # 【关键修复】仅在成功获取图像后释放缓冲区
+        if ret == mv_ok:
+            free_buffer(frame_out)
+
+
+def prepare_ocr_image(gray_image: np.ndarray) -> np.ndarray:
+    """
+    裁剪识别区域，并在设置了 OCR_MAX_SIDE 且区域过大时等比缩小。
+    """
+    image = gray_image
+    if OCR_ROI is not None:
+        y0, y1, x0, x1 = OCR_ROI
+        image = image[y0:y1, x0:x1]
+
+    long_side = max(image.shape[:2])
+    if OCR_MAX_SIDE is not None and long_side > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / long_side
+        image = cv2.resize(
+            image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
         )
+    return image
 
-        # --- OCR识别 ---
-        results = []
-        ocr_results = ocr.ocr(gray_image, cls=True)
-        if ocr_results:
-            for line in ocr_results:
-                if line is None:
-                    continue
-                for word_info in line:
-                    text = word_info[1][0]
-                    confidence = word_info[1][1]
-                    if confidence > OCR_CONFIDENCE_THRESHOLD:
-                        cleaned_text = fix_code(text)
-                        if cleaned_text:
-                            results.append(cleaned_text)
 
-        if not results:
-            print("未识别到任何有效结果")
-            # 保存原始图像
-            try:
-                # 获取当前日期和时间
-                now = datetime.now()
-                date_str = now.strftime("%Y-%m-%d")
-                time_str = now.strftime("%H_%M_%S_%f")[:-3]  # 保留毫秒
+def extract_codes(ocr_results) -> List[str]:
+    """
+    从OCR结果中提取置信度达标且清理后有效的识别码。
+    """
+    if not ocr_results:
+        return []
+
+    # 展平各行结果，再用置信度数组一次性筛选
+    words = [word_info for line in ocr_results if line for word_info in line]
+    confidences = np.fromiter(
+        (word_info[1][1] for word_info in words), dtype=np.float32, count=len(words)
+    )
+    mask = confidences > OCR_CONFIDENCE_THRESHOLD
+    texts = [
+        word_info[1][0]
+        for word_info, keep in zip(words, mask)
+        if keep and isinstance(word_info[1][0], str)
+    ]
+    return fix_codes(texts)
+
+
+def frame_hash(gray_image: np.ndarray) -> int:
+    """
+    计算图像的64位差值哈希（dHash）。
+    """
+    thumb = cv2.resize(gray_image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = np.packbits((thumb[:, 1:] > thumb[:, :-1]).ravel())
+    return int.from_bytes(bits.tobytes(), "big")
 
-                # 创建保存路径
-                save_dir = os.path.join("imgs", date_str)
-                os.makedirs(save_dir, exist_ok=True)
 
-                # 构建文件名并保存图片
-                filename = f"{time_str}.jpg"
-                save_path = os.path.join(save_dir, filename)
+def ocr_image(gray_image: np.ndarray) -> Optional[str]:
+    """
+    对灰度图像进行OCR识别。
+    返回: 识别出的最终字符串，失败则返回None。
+    """
+    global last_frame_hash, last_ocr_result
+    print("\n=== 开始识别 ===")
+    try:
+        # 画面未变化时复用上次结果
+        if OCR_SKIP_SAME_FRAME:
+            current_hash = frame_hash(gray_image)
+            if (
+                last_ocr_result
+                and bin(current_hash ^ last_frame_hash).count("1")
+                <= FRAME_HASH_MAX_DISTANCE
+            ):
+                print(f"画面未变化，复用上次结果: 「{last_ocr_result}」")
+                return last_ocr_result
 
-                # 使用原始图像数据保存
-                cv2.imwrite(save_path, image_data)
+        # --- OCR识别 ---
+        ocr_input = prepare_ocr_image(gray_image)
+        results = extract_codes(ocr.ocr(ocr_input, cls=OCR_USE_ANGLE_CLS))
+        if not results and OCR_RETRY_ROTATED:
+            print("未识别到有效结果，旋转180度后重试")
+            ocr_input = cv2.rotate(ocr_input, cv2.ROTATE_180)
+            results = extract_codes(ocr.ocr(ocr_input, cls=OCR_USE_ANGLE_CLS))
 
-                print(f"原始图片已保存至: {save_path}")
-            except Exception as e:
-                print(f"保存图片失败: {str(e)}")
+        if not results:
+            print("未识别到任何有效结果")
+            # 保存原始图像（交给后台线程写盘，不阻塞识别）
+            now = datetime.now()
+            date_str = now.strftime("%Y-%m-%d")
+            time_str = now.strftime("%H_%M_%S_%f")[:-3]  # 保留毫秒
+            save_path = os.path.join("imgs", date_str, f"{time_str}.jpg")
+            try:
+                save_queue.put_nowait((gray_image, save_path))
+            except Full:
+                print("图片保存队列已满，丢弃当前图片")
 
             return None
 
         # 统计最高频结果
-        most_common_result, _ = Counter(results).most_common(1)[0]
+        counts = {}
+        for result in results:
+            counts[result] = counts.get(result, 0) + 1
+        # 次数相同时取最先出现的结果
+        most_common_result = max(counts, key=counts.get)
         print(f"识别成功，结果: 「{most_common_result}」")
+        if OCR_SKIP_SAME_FRAME:
+            last_frame_hash, last_ocr_result = current_hash, most_common_result
         return most_common_result
 
     except Exception as e:
-        print(f"拍照识别过程异常：{str(e)}")
+        print(f"识别过程异常：{str(e)}")
         traceback.print_exc()
         return None
     finally:
-        # 【关键修复】仅在成功获取图像后释放缓冲区
-        if frame_out is not None and "ret" in locals() and ret == mvs.MV_OK:
-            cam.MV_CC_FreeImageBuffer(frame_out)
-        print("=== 拍照识别流程结束 ===")
+        print("=== 识别流程结束 ===")
+
+
+def publish_result(is_test: bool, result: Optional[str]):
+    """
+    发布识别结果。测试消息的结果发布到测试主题，失败时发布"test_failed"。
+    """
+    if is_test:
+        if result:
+            mqtt_client.publish(MQTT_TOPIC_TEST_PUB, result)
+            print(f"测试识别结果已发布到主题 {MQTT_TOPIC_TEST_PUB}")
+            return
+        mqtt_client.publish(MQTT_TOPIC_TEST_PUB, "test_failed")
+        print(f"测试识别失败，已发布到主题 {MQTT_TOPIC_TEST_PUB}")
+        return
+
+    if result:
+        mqtt_client.publish(MQTT_TOPIC_PUB, result)
+        print(f"识别结果已发布到主题 {MQTT_TOPIC_PUB}")
+
+
+def image_saver():
+    """
+    图片保存线程：从保存队列取图写入磁盘。
+    """
+    while True:
+        image, save_path = save_queue.get()
+        try:
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            cv2.imwrite(save_path, image, [cv2.IMWRITE_JPEG_QUALITY, SAVE_JPEG_QUALITY])
+            print(f"原始图片已保存至: {save_path}")
+        except Exception as e:
+            print(f"保存图片失败: {str(e)}")
+
+
+def ocr_worker():
+    """
+    OCR工作线程：从图像队列取图识别并发布结果，与拍照流程解耦。
+    """
+    while True:
+        is_test, gray_image = frame_queue.get()
+        try:
+            publish_result(is_test, ocr_image(gray_image))
+        except Exception as e:
+            print(f"OCR线程发生未知异常: {str(e)}")
+            traceback.print_exc()
+
+
+def get_pending_messages(timeout: float) -> List:
+    """
+    取出消息队列中积压的全部消息并合并：
+    触发消息只保留最新的一条，避免连续触发时对几乎相同的画面重复识别；
+    测试消息单独合并为一条，保证测试既不会顶替真实触发，也总能得到回复。
+    返回: 待处理的消息列表，真实触发在前。
+    """
+    messages = [message_queue.get(timeout=timeout)]
+    while True:
+        try:
+            messages.append(message_queue.get_nowait())
+        except Empty:
+            break
+
+    trigger_times = [message for message in messages if message != "test"]
+    has_test = len(trigger_times) < len(messages)
+    if len(messages) > 1:
+        print(f"合并了 {len(messages)} 条积压消息")
+
+    pending = []
+    if trigger_times:
+        pending.append(max(trigger_times))
+    if has_test:
+        pending.append("test")
+    return pending
+
+
+def handle_message(target_time):
+    """
+    处理一条触发消息：拍照后交给OCR线程识别。
+    """
+    is_test = target_time == "test"
+
+    # 再次检查消息是否过期（防止在队列中等待过久），测试消息不检查
+    if not is_test and (datetime.now() - target_time).total_seconds() > TTL_SECONDS:
+        print("队列中的消息已过期，忽略。")
+        return
+
+    gray_image = capture_image()
+    if gray_image is None:
+        if is_test:
+            publish_result(is_test, None)
+        return
+
+    try:
+        if is_test:
+            # 测试消息等待OCR线程空闲，避免因紧随真实触发而直接失败
+            frame_queue.put((is_test, gray_image), timeout=TTL_SECONDS)
+        else:
+            # OCR线程繁忙时丢弃当前图像
+            frame_queue.put_nowait((is_test, gray_image))
+    except Full:
+        print("OCR线程繁忙，丢弃当前图像。")
+        if is_test:
+            publish_result(is_test, None)
+
+
+def parse_timestamp(payload: str) -> datetime:
+    """
+    解析固定格式 "%Y-%m-%d %H:%M:%S" 的时间字符串，比 datetime.strptime 快。
+    格式错误时抛出 ValueError。
+    """
+    if (
+        len(payload) != 19
+        or payload[4] != "-"
+        or payload[7] != "-"
+        or payload[10] != " "
+        or payload[13] != ":"
+        or payload[16] != ":"
+    ):
+        raise ValueError(f"时间格式错误: {payload}")
+    return datetime(
+        int(payload[0:4]),
+        int(payload[5:7]),
+        int(payload[8:10]),
+        int(payload[11:13]),
+        int(payload[14:16]),
+        int(payload[17:19]),
+    )
 
 
 def on_mqtt_message(client, userdata, msg):
@@ -295,8 +577,7 @@ def on_mqtt_message(client, userdata, msg):
             message_queue.put(payload)
             return
 
-        time_format = "%Y-%m-%d %H:%M:%S"
-        target_time = datetime.strptime(payload, time_format)
+        target_time = parse_timestamp(payload)
 
         # 检查消息是否过期
         if (datetime.now() - target_time).total_seconds() > TTL_SECONDS:
@@ -317,6 +598,9 @@ def on_mqtt_message(client, userdata, msg):
 # ==============================================================================
 
 if __name__ == "__main__":
+    # 预热OCR引擎
+    warmup_ocr()
+
     # 初始化相机
     if not initialize_camera():
         print("相机初始化失败，程序退出。")
@@ -337,33 +621,17 @@ if __name__ == "__main__":
             mvs.MvCamera.MV_CC_Finalize()
         exit(1)
 
-    # 主循环
+    # 启动OCR工作线程和图片保存线程
+    threading.Thread(target=ocr_worker, daemon=True).start()
+    threading.Thread(target=image_saver, daemon=True).start()
+
+    # 主循环（拍照）
     try:
         while True:
             try:
-                # 从队列获取消息，超时1秒以便能响应KeyboardInterrupt
-                target_time = message_queue.get(timeout=1)
-                # 测试消息直接跳过
-                if target_time == "test":
-                    test_result = capture_and_ocr()
-                    if test_result:
-                        mqtt_client.publish(MQTT_TOPIC_TEST_PUB, test_result)
-                        print(f"测试识别结果已发布到主题 {MQTT_TOPIC_TEST_PUB}")
-                        continue
-                    mqtt_client.publish(MQTT_TOPIC_TEST_PUB, "test_failed")
-                    print(f"测试识别失败，已发布到主题 {MQTT_TOPIC_TEST_PUB}")
-                    continue
-
-                # 再次检查消息是否过期（防止在队列中等待过久）
-                if (datetime.now() - target_time).total_seconds() > TTL_SECONDS:
-                    print("队列中的消息已过期，忽略。")
-                    continue
-
-                # 执行识别任务
-                final_result = capture_and_ocr()
-                if final_result:
-                    mqtt_client.publish(MQTT_TOPIC_PUB, final_result)
-                    print(f"识别结果已发布到主题 {MQTT_TOPIC_PUB}")
+                # 从队列获取合并后的消息，超时1秒以便能响应KeyboardInterrupt
+                for target_time in get_pending_messages(timeout=1):
+                    handle_message(target_time)
 
             except Empty:
                 continue  # 队列为空，继续循环
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+from ctypes import POINTER, c_ubyte, cast
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "MvImport"))
+
+# 纯ctypes结构体定义，不加载相机SDK动态库
+from CameraParams_header import MV_FRAME_OUT  # noqa: E402
+
+from frame_utils import frame_to_gray_array  # noqa: E402
+
+
+def make_frame(buffer, height, width):
+    frame_out = MV_FRAME_OUT()
+    frame_out.pBufAddr = cast(buffer, POINTER(c_ubyte))
+    frame_out.stFrameInfo.nFrameLen = len(buffer)
+    frame_out.stFrameInfo.nHeight = height
+    frame_out.stFrameInfo.nWidth = width
+    return frame_out
+
+
+def test_frame_to_gray_array_copies_buffer():
+    buffer = (c_ubyte * 6)(*range(6))
+    gray_image = frame_to_gray_array(make_frame(buffer, 2, 3))
+
+    assert gray_image.dtype == np.uint8
+    np.testing.assert_array_equal(gray_image, [[0, 1, 2], [3, 4, 5]])
+
+    # 结果是独立副本，SDK缓冲区被复用后不受影响
+    buffer[0] = 255
+    assert gray_image[0, 0] == 0
+
+
+def test_frame_to_gray_array_rejects_short_buffer():
+    buffer = (c_ubyte * 5)(*range(5))
+    with pytest.raises(ValueError):
+        frame_to_gray_array(make_frame(buffer, 2, 3))